@@ -3,38 +3,250 @@ Trade aggregation: converts raw fills into position round-trips with P&L metrics
 """
 
 import logging
-from typing import Dict, Tuple, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
 
+import numpy as np
 import pandas as pd
 
 import config
 
+try:
+    import numba
+except ImportError:  # numba is optional; the state machine then runs as plain Python
+    numba = None
+
 logger = logging.getLogger(__name__)
 
+# int64 view of NaT, used for positions without a close time
+_NAT_NS = np.iinfo(np.int64).min
+
+# Direction labels indexed by (direction_sign > 0)
+_DIRECTION_LABELS = np.array(["SHORT", "LONG"], dtype=object)
+
+
+def _jit(func):
+    """Compile func with numba when it is installed, otherwise return it unchanged."""
+    if numba is None:
+        return func
+    return numba.njit(cache=True, nogil=True)(func)
+
+
+@_jit
+def _run_state_machine(key_ids, times_ns, signed, price, commission, realized, min_qty):
+    """
+    Walk sorted fills and build position round-trips per (symbol, positionSide) key.
+    
+    Fills arrive grouped by key, so only one position is ever in progress and its
+    state lives in local scalars; the loop only touches numeric data and
+    compiles under numba.
+    
+    Returns:
+        Tuple of (closed position columns, open position columns). Both share
+        the leading columns (key, open_time, direction, max_abs, qty_opened,
+        entry_notional, realized, commission, fills); closed positions end with
+        close_time and open positions with net_qty.
+    """
+    n = len(key_ids)
+    n_keys = 0
+    for i in range(n):
+        if i == 0 or key_ids[i] != key_ids[i - 1]:
+            n_keys += 1
+
+    # Each fill closes at most one position
+    out_key = np.empty(n, dtype=np.int64)
+    out_open_time = np.empty(n, dtype=np.int64)
+    out_close_time = np.empty(n, dtype=np.int64)
+    out_direction = np.empty(n, dtype=np.int8)
+    out_max_abs = np.empty(n, dtype=np.float64)
+    out_qty_opened = np.empty(n, dtype=np.float64)
+    out_entry_notional = np.empty(n, dtype=np.float64)
+    out_realized = np.empty(n, dtype=np.float64)
+    out_commission = np.empty(n, dtype=np.float64)
+    out_fills = np.empty(n, dtype=np.int64)
+    n_closed = 0
+
+    # Each key ends with at most one open position
+    open_key = np.empty(n_keys, dtype=np.int64)
+    open_open_time = np.empty(n_keys, dtype=np.int64)
+    open_direction = np.empty(n_keys, dtype=np.int8)
+    open_max_abs = np.empty(n_keys, dtype=np.float64)
+    open_qty_opened = np.empty(n_keys, dtype=np.float64)
+    open_entry_notional = np.empty(n_keys, dtype=np.float64)
+    open_realized = np.empty(n_keys, dtype=np.float64)
+    open_commission = np.empty(n_keys, dtype=np.float64)
+    open_fills = np.empty(n_keys, dtype=np.int64)
+    open_net_qty = np.empty(n_keys, dtype=np.float64)
+    n_open = 0
+
+    key = -1
+    active = False
+    open_time = 0
+    direction_sign = 0
+    qty_opened = 0.0
+    entry_notional = 0.0
+    max_abs = 0.0
+    fills = 0
+    commission_sum = 0.0
+    realized_sum = 0.0
+    net_qty = 0.0
+
+    for i in range(n + 1):
+        # End of a key's fills: a position still in progress stays open
+        if i == n or key_ids[i] != key:
+            if active:
+                open_key[n_open] = key
+                open_open_time[n_open] = open_time
+                open_direction[n_open] = direction_sign
+                open_max_abs[n_open] = max_abs
+                open_qty_opened[n_open] = qty_opened
+                open_entry_notional[n_open] = entry_notional
+                open_realized[n_open] = realized_sum
+                open_commission[n_open] = commission_sum
+                open_fills[n_open] = fills
+                open_net_qty[n_open] = net_qty
+                n_open += 1
+                active = False
+            if i == n:
+                break
+            key = key_ids[i]
+
+        q = signed[i]
+
+        # If state is flat, start a new position in the direction of this fill
+        if not active:
+            active = True
+            open_time = times_ns[i]
+            direction_sign = 1 if q > 0 else -1
+            qty_opened = 0.0
+            entry_notional = 0.0
+            max_abs = 0.0
+            fills = 0
+            commission_sum = 0.0
+            realized_sum = 0.0
+            net_qty = 0.0
+
+        fills += 1
+        commission_sum += commission[i]
+        realized_sum += realized[i]
+
+        prev_net = net_qty
+        net_qty = prev_net + q
+
+        # Update entry VWAP for same-direction fills
+        if direction_sign * q > 0:
+            qty_opened += q
+            entry_notional += price[i] * abs(q)
+
+        max_abs = max(max_abs, abs(net_qty))
+
+        # Normal close (reaching zero) or flip (crossing zero)
+        closed = abs(net_qty) < min_qty
+        flipped = not closed and ((prev_net > 0 and net_qty < 0) or (prev_net < 0 and net_qty > 0))
+        if not (closed or flipped):
+            continue
+
+        out_key[n_closed] = key
+        out_open_time[n_closed] = open_time
+        out_close_time[n_closed] = times_ns[i]
+        out_direction[n_closed] = direction_sign
+        out_max_abs[n_closed] = max_abs
+        out_qty_opened[n_closed] = qty_opened
+        out_entry_notional[n_closed] = entry_notional
+        out_realized[n_closed] = realized_sum
+        out_commission[n_closed] = commission_sum
+        out_fills[n_closed] = fills
+        n_closed += 1
 
-def _signed_qty(row: pd.Series) -> float:
+        if closed:
+            active = False
+        else:
+            # Start new position with leftover
+            open_time = times_ns[i]
+            direction_sign = 1 if net_qty > 0 else -1
+            qty_opened = net_qty
+            entry_notional = price[i] * abs(net_qty)
+            max_abs = abs(net_qty)
+            fills = 1
+            commission_sum = 0.0
+            realized_sum = 0.0
+
+    closed_out = (
+        out_key[:n_closed], out_open_time[:n_closed], out_direction[:n_closed],
+        out_max_abs[:n_closed], out_qty_opened[:n_closed], out_entry_notional[:n_closed],
+        out_realized[:n_closed], out_commission[:n_closed], out_fills[:n_closed],
+        out_close_time[:n_closed],
+    )
+    open_out = (
+        open_key[:n_open], open_open_time[:n_open], open_direction[:n_open],
+        open_max_abs[:n_open], open_qty_opened[:n_open], open_entry_notional[:n_open],
+        open_realized[:n_open], open_commission[:n_open], open_fills[:n_open],
+        open_net_qty[:n_open],
+    )
+    return closed_out, open_out
+
+
+def _partition_by_key(key_ids: np.ndarray, n_parts: int) -> List[Tuple[int, int]]:
     """
-    Convert BUY/SELL into signed quantity relative to positionSide.
+    Split key-sorted fills into up to n_parts contiguous row ranges of similar size.
     
-    For hedge mode (LONG/SHORT): BUY increases LONG, SELL increases SHORT.
-    For BOTH (net mode): BUY is positive, SELL is negative.
+    Ranges only break where the key changes, so every (symbol, positionSide)
+    group is processed as a whole by one state machine run.
     
     Args:
-        row: Trade row from dataframe
+        key_ids: Key id per fill, grouped by key
+        n_parts: Maximum number of ranges
         
     Returns:
-        Signed quantity
+        List of (start, stop) row ranges covering all fills
     """
-    qty = float(row["qty"])
-    side = row["side"]
-    ps = row.get("positionSide", config.POSITION_SIDE_DEFAULT)
-
-    if ps == "LONG":
-        return qty if side == "BUY" else -qty
-    elif ps == "SHORT":
-        return qty if side == "SELL" else -qty
-    else:
-        return qty if side == "BUY" else -qty
+    n = len(key_ids)
+    group_starts = np.concatenate(([0], np.flatnonzero(np.diff(key_ids)) + 1, [n]))
+    targets = np.linspace(0, n, max(n_parts, 1) + 1)[1:-1]
+    cuts = group_starts[np.searchsorted(group_starts, targets)]
+    edges = np.unique(np.concatenate(([0], cuts, [n])))
+    if len(edges) < 2:
+        return [(0, n)]
+    return [(int(start), int(stop)) for start, stop in zip(edges[:-1], edges[1:])]
+
+
+def _position_columns(symbols: np.ndarray, position_sides: np.ndarray, key: np.ndarray,
+                      open_time: np.ndarray, close_time: np.ndarray, direction: np.ndarray,
+                      max_abs: np.ndarray, qty_opened: np.ndarray, entry_notional: np.ndarray,
+                      realized: np.ndarray, commission: np.ndarray, fills: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Derive positions output columns from state machine output columns.
+    
+    Args:
+        symbols: Symbol name per symbol code
+        position_sides: positionSide name per positionSide code
+        key: Key id per position (symbol code * len(position_sides) + positionSide code)
+        open_time: Open timestamps as int64 nanoseconds
+        close_time: Close timestamps as int64 nanoseconds (_NAT_NS if still open)
+        direction: +1 for LONG, -1 for SHORT
+    
+    Returns:
+        Dict of column name to array, one entry per position
+    """
+    entry_qty = np.abs(qty_opened)
+    entry_vwap = np.divide(entry_notional, entry_qty, out=np.zeros_like(entry_qty), where=entry_qty > 0)
+    duration_min = np.where(close_time != _NAT_NS, (close_time - open_time) / 6e10, np.nan)
+
+    return {
+        "symbol": symbols[key // len(position_sides)],
+        "positionSide": position_sides[key % len(position_sides)],
+        "direction": _DIRECTION_LABELS[(direction > 0).astype(np.intp)],
+        "open_time": open_time.view("datetime64[ns]"),
+        "close_time": close_time.view("datetime64[ns]"),
+        "duration_min": duration_min,
+        "max_position_qty": max_abs,
+        "entry_qty": entry_qty,
+        "entry_vwap": entry_vwap,
+        "realizedPnl": realized,
+        "commission": commission,
+        "net_pnl_after_fees": realized - commission,
+        "fills": fills,
+    }
 
 
 def aggregate_trades_to_positions(df: pd.DataFrame) -> pd.DataFrame:
@@ -50,150 +262,95 @@ def aggregate_trades_to_positions(df: pd.DataFrame) -> pd.DataFrame:
     Returns:
         DataFrame with aggregated positions
     """
-    df = df.copy()
-
-    # Normalize types
-    df["time"] = pd.to_datetime(df["time"])
-    for col in config.NUMERIC_COLUMNS:
-        df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0.0)
-
-    # Ensure stable ordering
-    df = df.sort_values(["symbol", "positionSide", "time", "id"]).reset_index(drop=True)
-
-    positions = []
-    state = {}
-
-    def start_state(key: Tuple, first_row: pd.Series, signed_q: float) -> None:
-        """Initialize a new position state."""
-        state[key] = {
-            "symbol": first_row["symbol"],
-            "positionSide": first_row.get("positionSide", config.POSITION_SIDE_DEFAULT),
-            "open_time": first_row["time"],
-            "close_time": pd.NaT,
-            "direction": "LONG" if signed_q > 0 else "SHORT",
-            "qty_opened": 0.0,
-            "entry_notional": 0.0,
-            "max_abs_qty": 0.0,
-            "fills": 0,
-            "commission": 0.0,
-            "realizedPnl": 0.0,
-            "net_qty": 0.0,
-        }
-
-    def flush_if_closed(key: Tuple) -> None:
-        """If position is closed, append to positions list."""
-        st = state[key]
-        if abs(st["net_qty"]) < config.MIN_QTY_THRESHOLD:
-            entry_qty = abs(st["qty_opened"])
-            entry_vwap = (st["entry_notional"] / entry_qty) if entry_qty > 0 else 0.0
-
-            positions.append({
-                "symbol": st["symbol"],
-                "positionSide": st["positionSide"],
-                "direction": st["direction"],
-                "open_time": st["open_time"],
-                "close_time": st["close_time"],
-                "duration_min": (st["close_time"] - st["open_time"]).total_seconds() / 60.0
-                                if pd.notna(st["close_time"]) else None,
-                "max_position_qty": st["max_abs_qty"],
-                "entry_qty": entry_qty,
-                "entry_vwap": entry_vwap,
-                "realizedPnl": st["realizedPnl"],
-                "commission": st["commission"],
-                "net_pnl_after_fees": st["realizedPnl"] - st["commission"],
-                "fills": st["fills"],
-            })
-            del state[key]
-
-    # Process each trade
-    for _, row in df.iterrows():
-        key = (row["symbol"], row.get("positionSide", config.POSITION_SIDE_DEFAULT))
-        signed_q = _signed_qty(row)
-        price = float(row["price"])
-        commission = float(row["commission"])
-        realized = float(row["realizedPnl"])
-
-        # Initialize state if needed
-        if key not in state:
-            start_state(key, row, signed_q)
-
-        st = state[key]
-
-        # If state is flat, restart
-        if abs(st["net_qty"]) < config.MIN_QTY_THRESHOLD:
-            start_state(key, row, signed_q)
-            st = state[key]
-
-        st["fills"] += 1
-        st["commission"] += commission
-        st["realizedPnl"] += realized
-
-        prev_net = st["net_qty"]
-        new_net = prev_net + signed_q
+    # Normalize types into arrays; the caller's frame is never modified
+    times_ns = pd.to_datetime(df["time"]).to_numpy(dtype="datetime64[ns]").view(np.int64)
+    ids = pd.to_numeric(df["id"], errors="coerce").to_numpy()
+    qty_arr, price_arr, commission_arr, realized_arr = [
+        pd.to_numeric(df[col], errors="coerce").fillna(0.0).to_numpy(dtype=np.float64)
+        for col in ("qty", "price", "commission", "realizedPnl")
+    ]
 
-        # Update entry VWAP for same-direction fills
-        opening_sign = 1 if st["direction"] == "LONG" else -1
-        if opening_sign * signed_q > 0:
-            st["qty_opened"] += signed_q
-            st["entry_notional"] += price * abs(signed_q)
+    # Encode (symbol, positionSide) as one integer key for the state machine;
+    # sorted codes make key order match string order
+    symbol_codes, symbols = pd.factorize(df["symbol"], sort=True)
+    symbols = np.asarray(symbols, dtype=object)
+    position_side = df["positionSide"].fillna(config.POSITION_SIDE_DEFAULT)
+    net_mode = bool((position_side == "BOTH").all())
 
-        st["net_qty"] = new_net
-        st["max_abs_qty"] = max(st["max_abs_qty"], abs(new_net))
+    if net_mode:
+        # Net (one-way) mode: symbol alone identifies the position
+        position_sides = np.array(["BOTH"], dtype=object)
+        order = np.lexsort((ids, times_ns, symbol_codes))
+        key_ids = symbol_codes[order].astype(np.int64)
+    else:
+        ps_codes, position_sides = pd.factorize(position_side, sort=True)
+        position_sides = np.asarray(position_sides, dtype=object)
+        order = np.lexsort((ids, times_ns, ps_codes, symbol_codes))
+        ps_codes = ps_codes[order]
+        key_ids = symbol_codes[order].astype(np.int64) * len(position_sides) + ps_codes
 
-        # Handle position flips (crossing zero)
-        if (prev_net > 0 and new_net < 0) or (prev_net < 0 and new_net > 0):
-            st["close_time"] = row["time"]
-            st["net_qty"] = 0.0
-            flush_if_closed(key)
+    # Apply the stable ordering (symbol, positionSide, time, id) to the fill columns
+    times_ns = times_ns[order]
+    side_arr = df["side"].to_numpy()[order]
+    qty_arr = qty_arr[order]
+    price_arr = price_arr[order]
+    commission_arr = commission_arr[order]
+    realized_arr = realized_arr[order]
 
-            # Start new position with leftover
-            leftover = new_net
-            start_state(key, row, leftover)
-            st2 = state[key]
-            st2["fills"] = 1
-            st2["commission"] = 0.0
-            st2["realizedPnl"] = 0.0
-            st2["net_qty"] = leftover
-            st2["qty_opened"] = leftover
-            st2["entry_notional"] = price * abs(leftover)
-            st2["max_abs_qty"] = abs(leftover)
-
-        # Normal close (reaching zero)
-        if abs(st["net_qty"]) < config.MIN_QTY_THRESHOLD:
-            st["close_time"] = row["time"]
-            flush_if_closed(key)
+    # Signed quantity relative to positionSide.
+    # Hedge mode (LONG/SHORT): BUY increases LONG, SELL increases SHORT.
+    # Net mode (BOTH): BUY is positive, SELL is negative.
+    if net_mode:
+        sign = np.where(side_arr == "BUY", 1.0, -1.0)
+    else:
+        is_short = (position_sides == "SHORT")[ps_codes]
+        sign = np.where((~is_short & (side_arr == "BUY")) | (is_short & (side_arr == "SELL")), 1.0, -1.0)
+    signed_arr = sign * qty_arr
+
+    def run_range(bounds: Tuple[int, int]) -> Tuple:
+        start, stop = bounds
+        return _run_state_machine(
+            key_ids[start:stop], times_ns[start:stop], signed_arr[start:stop],
+            price_arr[start:stop], commission_arr[start:stop], realized_arr[start:stop],
+            config.MIN_QTY_THRESHOLD,
+        )
+
+    # Keys are independent; the compiled kernel releases the GIL, so ranges of
+    # keys can run on threads. Without numba a single run avoids thread overhead.
+    if numba is not None:
+        ranges = _partition_by_key(key_ids, config.AGGREGATION_WORKERS)
+    else:
+        ranges = [(0, len(key_ids))]
+    if len(ranges) > 1:
+        with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            results = list(executor.map(run_range, ranges))
+    else:
+        results = [run_range(ranges[0])]
+
+    closed_parts = [closed for closed, _ in results]
+    open_parts = [opened for _, opened in results]
+    n_closed = sum(len(part[0]) for part in closed_parts)
+    n_open = sum(len(part[0]) for part in open_parts)
+
+    # Closed positions first, then open ones: one concatenation per column
+    (key, open_time, direction, max_abs, qty_opened, entry_notional, realized, commission, fills) = [
+        np.concatenate([part[i] for part in closed_parts + open_parts]) for i in range(9)
+    ]
+    close_time = np.concatenate([part[9] for part in closed_parts]
+                                + [np.full(n_open, _NAT_NS, dtype=np.int64)])
+    columns = _position_columns(symbols, position_sides, key, open_time, close_time, direction,
+                                max_abs, qty_opened, entry_notional, realized, commission, fills)
 
     # Handle open positions
-    open_positions = []
-    for key, st in list(state.items()):
-        entry_qty = abs(st["qty_opened"])
-        entry_vwap = (st["entry_notional"] / entry_qty) if entry_qty > 0 else 0.0
-        open_positions.append({
-            "symbol": st["symbol"],
-            "positionSide": st["positionSide"],
-            "direction": st["direction"],
-            "open_time": st["open_time"],
-            "close_time": pd.NaT,
-            "duration_min": None,
-            "max_position_qty": st["max_abs_qty"],
-            "entry_qty": entry_qty,
-            "entry_vwap": entry_vwap,
-            "realizedPnl": st["realizedPnl"],
-            "commission": st["commission"],
-            "net_pnl_after_fees": st["realizedPnl"] - st["commission"],
-            "fills": st["fills"],
-            "status": "OPEN",
-            "net_qty": st["net_qty"],
-        })
-
-    # Combine closed and open positions
-    positions_df = pd.DataFrame(positions)
-    open_df = pd.DataFrame(open_positions)
-
-    if not open_df.empty:
-        positions_df["status"] = "CLOSED"
-        positions_df = pd.concat([positions_df, open_df], ignore_index=True)
+    if n_open:
+        status = np.full(n_closed + n_open, "CLOSED", dtype=object)
+        status[n_closed:] = "OPEN"
+        net_qty = np.full(n_closed + n_open, np.nan)
+        net_qty[n_closed:] = np.concatenate([part[9] for part in open_parts])
+        columns["status"] = status
+        columns["net_qty"] = net_qty
 
+    positions_df = pd.DataFrame(columns)
     result = positions_df.sort_values(["open_time"]).reset_index(drop=True)
-    logger.info(f"Aggregated into {len(result)} positions ({len(positions)} closed, {len(open_positions)} open)")
+    logger.info(f"Aggregated into {len(result)} positions ({n_closed} closed, {n_open} open)")
     return result
@@ -7,10 +7,15 @@ import hmac
 import hashlib
 import random
 import logging
-import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import List, Dict, Tuple, Optional
+from urllib.parse import urlencode
 
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
 
 import config
 import state_manager
@@ -18,6 +23,57 @@ import state_manager
 logger = logging.getLogger(__name__)
 
 
+class _RequestWeightLimiter:
+    """
+    Thread-safe token bucket keeping request weight under Binance's per-minute limit.
+    
+    The bucket holds at most one second of weight, so bursts from concurrent
+    workers cannot overshoot the per-minute budget.
+    """
+
+    def __init__(self, weight_per_minute: int):
+        self._rate = weight_per_minute / 60.0
+        self._capacity = max(self._rate, config.USER_TRADES_WEIGHT)
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, weight: int) -> None:
+        """Block until `weight` request weight is available, then consume it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if self._tokens >= weight:
+                    self._tokens -= weight
+                    return
+                wait_s = (weight - self._tokens) / self._rate
+            time.sleep(wait_s)
+
+
+_weight_limiter = _RequestWeightLimiter(config.REQUEST_WEIGHT_PER_MINUTE)
+
+
+def create_session() -> requests.Session:
+    """
+    Create a requests session with a connection pool sized for concurrent fetches.
+    
+    Returns:
+        Session reusing TCP/TLS connections across fetch worker threads
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=config.FETCH_WORKERS, pool_maxsize=config.FETCH_WORKERS)
+    session.mount('https://', adapter)
+    return session
+
+
+@lru_cache(maxsize=None)
+def _hmac_template(secret: str) -> hmac.HMAC:
+    """Keyed HMAC SHA256 object for secret; copies skip re-deriving the key pads."""
+    return hmac.new(secret.encode('utf-8'), digestmod=hashlib.sha256)
+
+
 def get_binance_signature(data: str, secret: str) -> str:
     """
     Generate HMAC SHA256 signature for Binance API requests.
@@ -29,7 +85,9 @@ def get_binance_signature(data: str, secret: str) -> str:
     Returns:
         Hex-encoded HMAC SHA256 signature
     """
-    return hmac.new(secret.encode('utf-8'), data.encode('utf-8'), hashlib.sha256).hexdigest()
+    h = _hmac_template(secret).copy()
+    h.update(data.encode('utf-8'))
+    return h.hexdigest()
 
 
 def request_with_retry(session: requests.Session, method: str, url: str, 
@@ -89,14 +147,14 @@ def get_active_symbols(session: requests.Session) -> List[str]:
     """
     try:
         endpoint = '/fapi/v2/positionRisk'
-        params = {'timestamp': int(time.time() * 1000)}
-        query_string = '&'.join([f"{k}={v}" for k, v in params.items()])
+        params = {'timestamp': time.time_ns() // 1_000_000}
+        query_string = urlencode(params)
         signature = get_binance_signature(query_string, config.SECRET_KEY)
         url = f"{config.BASE_URL}{endpoint}?{query_string}&signature={signature}"
         headers = {'X-MBX-APIKEY': config.API_KEY}
 
         resp = request_with_retry(session, 'GET', url, headers)
-        positions = resp.json()
+        positions = orjson.loads(resp.content)
         symbols = [pos['symbol'] for pos in positions if float(pos['positionAmt']) != 0]
         logger.info(f"Found {len(symbols)} symbols with open positions")
         return symbols
@@ -106,43 +164,112 @@ def get_active_symbols(session: requests.Session) -> List[str]:
         return []
 
 
-def get_symbols_to_query(active_symbols: List[str]) -> List[str]:
+def get_symbols_to_query(active_symbols: List[str], state: Optional[Dict] = None) -> List[str]:
     """
-    Build complete symbol list from active symbols + historical symbols from CSV.
+    Build complete symbol list from active symbols + historical symbols from state.
     
-    This ensures we don't miss fills from recently closed positions.
+    This ensures we don't miss fills from recently closed positions. Historical
+    symbols are kept in state["known_symbols"]; state files written before that
+    key existed fall back to the symbols in the per-symbol ID watermark.
     
     Args:
         active_symbols: Currently active symbols with open positions
+        state: Current state dict with watermark info
         
     Returns:
         Sorted list of all symbols to query
     """
-    import pandas as pd
+    if state is None:
+        state = state_manager.load_state()
     
     symbols = set(active_symbols)
     
-    # Add historical symbols from fills CSV
-    if os.path.exists(config.FILLS_CSV) and os.path.getsize(config.FILLS_CSV) > 0:
-        try:
-            df = pd.read_csv(config.FILLS_CSV, usecols=["symbol"])
-            historical = set(df["symbol"].dropna().unique())
-            symbols |= historical
-            logger.info(f"Added {len(historical)} historical symbols from CSV")
-        except Exception as e:
-            logger.warning(f"Could not load historical symbols: {e}")
+    historical = state.get("known_symbols", state.get("last_id_by_symbol", {}))
+    symbols.update(historical)
+    logger.info(f"Added {len(historical)} historical symbols from state")
     
     result = sorted(symbols)
     logger.info(f"Total symbols to query: {len(result)}")
     return result
 
 
+def _fetch_symbol_trades(session: requests.Session, symbol: str, from_id: int,
+                         start_time_ms: int) -> List[Dict]:
+    """
+    Fetch all new trades for one symbol, following pagination.
+    
+    Args:
+        session: Requests session for API calls
+        symbol: Symbol to query
+        from_id: Last trade ID already stored for this symbol (0 if none)
+        start_time_ms: Time watermark used when no trade ID is known
+        
+    Returns:
+        List of trades for the symbol
+    """
+    endpoint = '/fapi/v1/userTrades'
+    trades_for_symbol = []
+    page = 0
+    
+    # Pagination loop: fetch until no more trades
+    while True:
+        page += 1
+        # Wait for request weight before signing, so time spent queued does not
+        # count against recvWindow. Retries inside request_with_retry are not
+        # charged; they are rare and already spaced out by backoff.
+        _weight_limiter.acquire(config.USER_TRADES_WEIGHT)
+        params = {
+            'symbol': symbol,
+            'limit': config.MAX_LIMIT,
+            'timestamp': time.time_ns() // 1_000_000
+        }
+        
+        # Use fromId for pagination if available
+        if from_id > 0:
+            params['fromId'] = from_id + 1
+        # Otherwise use time watermark
+        elif start_time_ms > 0:
+            params['startTime'] = start_time_ms
+        
+        query_string = urlencode(params)
+        signature = get_binance_signature(query_string, config.SECRET_KEY)
+        url = f"{config.BASE_URL}{endpoint}?{query_string}&signature={signature}"
+        headers = {'X-MBX-APIKEY': config.API_KEY}
+        
+        resp = request_with_retry(session, 'GET', url, headers)
+        trades = orjson.loads(resp.content)
+        
+        if not trades:
+            logger.debug(f"{symbol} page {page}: no more trades")
+            break
+        
+        # Filter trades by start_time if using time-based pagination.
+        # Trades come back in ascending time order, so drop the leading prefix
+        # only; startTime already filters server-side, so usually nothing is copied.
+        if start_time_ms > 0 and from_id == 0:
+            first = next((i for i, t in enumerate(trades) if t['time'] >= start_time_ms), len(trades))
+            if first:
+                trades = trades[first:]
+        
+        trades_for_symbol.extend(trades)
+        from_id = trades[-1]['id']
+        
+        logger.debug(f"{symbol} page {page}: fetched {len(trades)} trades (fromId: {from_id})")
+        
+        # Stop if less than limit (means we got all available)
+        if len(trades) < config.MAX_LIMIT:
+            break
+    
+    return trades_for_symbol
+
+
 def fetch_new_trades(session: requests.Session, symbols: List[str], 
                      start_date: Optional[str] = None, state: Optional[Dict] = None) -> Tuple[List[Dict], Dict]:
     """
     Fetch new futures trades from Binance with pagination and time-based watermarking.
     
     Uses startTime watermark to avoid missing trades. Handles pagination for >1000 trades per symbol.
+    Symbols are fetched concurrently on up to config.FETCH_WORKERS threads.
     
     Args:
         session: Requests session for API calls
@@ -173,63 +300,26 @@ def fetch_new_trades(session: requests.Session, symbols: List[str],
     else:
         start_time_ms = state.get("last_trade_time_ms", 0)
     
-    endpoint = '/fapi/v1/userTrades'
-    
-    for symbol in symbols:
-        try:
-            trades_for_symbol = []
-            from_id = state.get("last_id_by_symbol", {}).get(symbol, 0)
-            page = 0
-            
-            # Pagination loop: fetch until no more trades
-            while True:
-                page += 1
-                params = {
-                    'symbol': symbol,
-                    'limit': config.MAX_LIMIT,
-                    'timestamp': int(time.time() * 1000)
-                }
-                
-                # Use fromId for pagination if available
-                if from_id > 0:
-                    params['fromId'] = from_id + 1
-                # Otherwise use time watermark
-                elif start_time_ms > 0:
-                    params['startTime'] = start_time_ms
-                
-                query_string = '&'.join([f"{k}={v}" for k, v in params.items()])
-                signature = get_binance_signature(query_string, config.SECRET_KEY)
-                url = f"{config.BASE_URL}{endpoint}?{query_string}&signature={signature}"
-                headers = {'X-MBX-APIKEY': config.API_KEY}
-                
-                resp = request_with_retry(session, 'GET', url, headers)
-                trades = resp.json()
-                
-                if not trades:
-                    logger.debug(f"{symbol} page {page}: no more trades")
-                    break
-                
-                # Filter trades by start_time if using time-based pagination
-                if start_time_ms > 0 and from_id == 0:
-                    trades = [t for t in trades if t['time'] >= start_time_ms]
-                
-                trades_for_symbol.extend(trades)
-                from_id = trades[-1]['id']
-                
-                logger.debug(f"{symbol} page {page}: fetched {len(trades)} trades (fromId: {from_id})")
-                
-                # Stop if less than limit (means we got all available)
-                if len(trades) < config.MAX_LIMIT:
-                    break
+    # Symbols are fetched concurrently; state is only updated on this thread
+    last_ids = state.get("last_id_by_symbol", {})
+    with ThreadPoolExecutor(max_workers=config.FETCH_WORKERS) as executor:
+        futures = [
+            (symbol, executor.submit(_fetch_symbol_trades, session, symbol,
+                                     last_ids.get(symbol, 0), start_time_ms))
+            for symbol in symbols
+        ]
+        
+        for symbol, future in futures:
+            try:
+                trades_for_symbol = future.result()
+            except Exception as e:
+                logger.error(f"Error fetching {symbol}: {e}")
+                continue
             
             if trades_for_symbol:
                 all_trades.extend(trades_for_symbol)
                 state = state_manager.update_watermark(state, trades_for_symbol)
                 logger.info(f"{symbol}: {len(trades_for_symbol)} trades")
-            
-        except Exception as e:
-            logger.error(f"Error fetching {symbol}: {e}")
-            continue
     
     logger.info(f"Total trades fetched: {len(all_trades)}")
     return all_trades, state
@@ -14,7 +14,8 @@ SECRET_KEY = os.getenv('SECRET_KEY')
 BASE_URL = 'https://fapi.binance.com'
 
 # File Storage
-FILLS_CSV = 'futures_fills.csv'
+FILLS_DATASET = 'futures_fills'  # Parquet dataset directory, partitioned by trade date
+LEGACY_FILLS_CSV = 'futures_fills.csv'
 POSITIONS_CSV = 'futures_positions.csv'
 STATE_FILE = 'state.json'
 
@@ -22,11 +23,15 @@ STATE_FILE = 'state.json'
 NUMERIC_COLUMNS = ['price', 'qty', 'realizedPnl', 'quoteQty', 'commission']
 POSITION_SIDE_DEFAULT = 'BOTH'
 MIN_QTY_THRESHOLD = 1e-12
+AGGREGATION_WORKERS = os.cpu_count() or 1
 
 # API Constants
 REQUEST_TIMEOUT = 10
 MAX_RETRIES = 5
 MAX_LIMIT = 1000
+FETCH_WORKERS = 8
+REQUEST_WEIGHT_PER_MINUTE = 2400  # Binance futures IP limit
+USER_TRADES_WEIGHT = 5
 
 # Logging
 LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -5,12 +5,11 @@ Main orchestrator that coordinates:
 - API client for fetching trades
 - State manager for watermarking
 - Aggregator for position calculations
-- Output writer for CSV persistence
+- Output writer for fills (Parquet) and positions (CSV) persistence
 """
 
 import sys
 import logging
-import requests
 from typing import Optional
 from datetime import datetime
 
@@ -57,13 +56,17 @@ def main(start_date: Optional[str] = None) -> int:
         if not validate_configuration():
             return 1
         
+        # One-time import of fills stored by older versions as CSV
+        output_writer.migrate_legacy_fills_csv()
+        
         # Load watermark state
         state = state_manager.load_state()
+        state_manager.seed_known_symbols(state, output_writer.read_fill_symbols)
         last_time = state.get('last_trade_time_ms', 0)
         logger.info(f"Loaded watermark: last_trade_time={last_time}")
         
         # Create session for API calls
-        session = requests.Session()
+        session = binance_client.create_session()
         
         try:
             # Fetch active symbols
@@ -73,7 +76,7 @@ def main(start_date: Optional[str] = None) -> int:
                 logger.warning("No active symbols found")
             
             # Build complete symbol list (active + historical)
-            symbols = binance_client.get_symbols_to_query(active_symbols)
+            symbols = binance_client.get_symbols_to_query(active_symbols, state)
             if not symbols:
                 logger.warning("No symbols to query")
                 return 0
@@ -88,18 +91,15 @@ def main(start_date: Optional[str] = None) -> int:
                 logger.info("No new trades fetched")
                 return 0
             
-            # Save updated watermark
-            state_manager.save_state(updated_state)
+            # Write raw fills to Parquet; keep the combined fills for aggregation
+            logger.info("Writing raw fills to Parquet...")
+            df_fills = output_writer.write_fills_parquet(trades)
             
-            # Write raw fills to CSV
-            logger.info("Writing raw fills to CSV...")
-            total_fills = output_writer.write_fills_csv(trades)
+            # Save updated watermark only once the fills are stored
+            state_manager.save_state(updated_state)
             
             # Aggregate into positions
             logger.info("Aggregating trades into positions...")
-            import pandas as pd
-            df_fills = pd.read_csv(config.FILLS_CSV)
-            df_fills['time'] = pd.to_datetime(df_fills['time'])
             positions_df = aggregator.aggregate_trades_to_positions(df_fills)
             
             # Write positions to CSV
@@ -1,17 +1,26 @@
 """
-Output writers for CSV files: raw fills and derived positions.
+Output writers: raw fills (Parquet dataset) and derived positions (CSV).
 """
 
 import os
+import uuid
+import shutil
 import logging
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from pyarrow import csv as pacsv
 
 import config
 
 logger = logging.getLogger(__name__)
 
+# Fills are partitioned by trade date (hive-style date=YYYY-MM-DD directories)
+_FILLS_PARTITIONING = ds.partitioning(pa.schema([("date", pa.string())]), flavor="hive")
+_FILLS_WRITE_OPTIONS = ds.ParquetFileFormat().make_write_options(compression="zstd")
+
 
 def _atomic_write(filepath: str, df: pd.DataFrame) -> None:
     """
@@ -27,46 +36,136 @@ def _atomic_write(filepath: str, df: pd.DataFrame) -> None:
     logger.info(f"Wrote {len(df)} rows to {filepath}")
 
 
-def write_fills_csv(new_trades: List[Dict]) -> int:
+def _normalize_fills(df: pd.DataFrame) -> pd.DataFrame:
+    """Cast parsed fill columns to the types stored in the fills dataset."""
+    df['time'] = df['time'].astype('datetime64[ms]')
+    df['id'] = pd.to_numeric(df['id'], errors='coerce').astype('int64')
+    for col in config.NUMERIC_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+    return df
+
+
+def _append_fills(df: pd.DataFrame) -> None:
     """
-    Append new trades to raw fills CSV (append-only, immutable).
+    Write fills as new Parquet files into the date-partitioned fills dataset.
+    
+    Existing files are never rewritten; each call adds uniquely named files.
+    Files are written to a temp directory first and then renamed into place,
+    so an interrupted write never leaves a truncated file in the dataset.
+    
+    Args:
+        df: Normalized fills to append
+    """
+    table = pa.Table.from_pandas(df.assign(date=df['time'].dt.strftime('%Y-%m-%d')), preserve_index=False)
+    tmp_dir = f"{config.FILLS_DATASET}.tmp-{uuid.uuid4().hex}"
+    try:
+        ds.write_dataset(
+            table, tmp_dir, format="parquet",
+            partitioning=_FILLS_PARTITIONING,
+            basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+            file_options=_FILLS_WRITE_OPTIONS,
+        )
+        if not os.path.isdir(config.FILLS_DATASET):
+            # First write: publish the whole dataset with a single rename
+            os.replace(tmp_dir, config.FILLS_DATASET)
+        else:
+            for root, _, files in os.walk(tmp_dir):
+                target_dir = os.path.join(config.FILLS_DATASET, os.path.relpath(root, tmp_dir))
+                os.makedirs(target_dir, exist_ok=True)
+                for name in files:
+                    os.replace(os.path.join(root, name), os.path.join(target_dir, name))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    logger.info(f"Wrote {len(df)} rows to {config.FILLS_DATASET}")
+
+
+def read_fills(columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Load raw fills from the Parquet fills dataset.
+    
+    Args:
+        columns: Optional subset of columns to read
+        
+    Returns:
+        DataFrame with stored fills (empty if nothing has been written yet)
+    """
+    if not os.path.isdir(config.FILLS_DATASET):
+        return pd.DataFrame(columns=columns)
+
+    dataset = ds.dataset(config.FILLS_DATASET, format="parquet", partitioning=_FILLS_PARTITIONING)
+    # self_destruct frees Arrow buffers during conversion instead of holding both copies
+    df = dataset.to_table(columns=columns).to_pandas(self_destruct=True)
+    return df.drop(columns=['date'], errors='ignore')
+
+
+def read_fill_symbols() -> List[str]:
+    """Return the distinct symbols in the stored fills."""
+    df = read_fills(columns=['symbol'])
+    return df['symbol'].dropna().unique().tolist()
+
+
+def migrate_legacy_fills_csv() -> int:
+    """
+    Import fills from the legacy CSV store into the Parquet dataset, once.
+    
+    The CSV file is left in place; it is only read while no dataset exists yet.
+    
+    Returns:
+        Number of fills imported
+    """
+    if os.path.isdir(config.FILLS_DATASET) or not os.path.exists(config.LEGACY_FILLS_CSV) \
+            or os.path.getsize(config.LEGACY_FILLS_CSV) == 0:
+        return 0
+
+    table = pacsv.read_csv(config.LEGACY_FILLS_CSV, read_options=pacsv.ReadOptions(use_threads=True))
+    df = table.to_pandas(self_destruct=True)
+    del table
+    df['time'] = pd.to_datetime(df['time'])
+    df = _normalize_fills(df).drop_duplicates(subset=['id'], keep='first').sort_values('time')
+    _append_fills(df)
+    logger.info(f"Imported {len(df)} fills from {config.LEGACY_FILLS_CSV}")
+    return len(df)
+
+
+def write_fills_parquet(new_trades: List[Dict]) -> pd.DataFrame:
+    """
+    Append new trades to the raw fills dataset (append-only, immutable).
+    
+    Trades whose id is already stored are dropped and the rest are written as
+    new Parquet files, so existing data is never rewritten. The stored fills
+    loaded for deduplication are returned together with the new ones, so
+    callers don't need to read the dataset again.
     
     Args:
         new_trades: List of trade dictionaries from Binance API
         
     Returns:
-        Total number of fills in CSV
+        DataFrame with all stored fills, including the appended trades
     """
     if not new_trades:
         logger.info("No new trades to append")
-        return 0
+        return read_fills()
 
     df_new = pd.DataFrame(new_trades)
     df_new['time'] = pd.to_datetime(df_new['time'], unit='ms')
+    df_new = _normalize_fills(df_new)
+    df_new = df_new.drop_duplicates(subset=['id'], keep='first').sort_values('time').reset_index(drop=True)
     
-    # Load existing fills
-    if os.path.exists(config.FILLS_CSV) and os.path.getsize(config.FILLS_CSV) > 0:
-        try:
-            df_existing = pd.read_csv(config.FILLS_CSV)
-            df_existing['id'] = pd.to_numeric(df_existing['id'], errors='coerce')
-            df_existing['time'] = pd.to_datetime(df_existing['time'])
-            # Deduplicate by trade id (keeps only first occurrence)
-            combined_df = pd.concat([df_existing, df_new]).drop_duplicates(subset=['id'], keep='first').reset_index(drop=True)
-            logger.info(f"Combined with {len(df_existing)} existing fills")
-        except Exception as e:
-            logger.error(f"Error reading existing fills CSV: {e}. Using new trades only.")
-            combined_df = df_new
+    # Deduplicate by trade id against stored fills
+    df_existing = read_fills()
+    if not df_existing.empty:
+        df_new = df_new[~df_new['id'].isin(df_existing['id'])]
+        combined_df = pd.concat([df_existing, df_new], ignore_index=True)
+        logger.info(f"Combined with {len(df_existing)} existing fills")
     else:
         combined_df = df_new
-
-    # Sort by time
-    combined_df = combined_df.sort_values('time').reset_index(drop=True)
     
-    # Write raw fills (atomic write)
-    _atomic_write(config.FILLS_CSV, combined_df)
+    if not df_new.empty:
+        _append_fills(df_new)
     logger.info(f"Appended {len(df_new)} new trades. Total fills: {len(combined_df)}")
     
-    return len(combined_df)
+    return combined_df
 
 
 def write_positions_csv(positions_df: pd.DataFrame) -> int:
@@ -103,8 +202,10 @@ def format_positions_summary(positions_df: pd.DataFrame) -> str:
     if positions_df.empty:
         return "No positions"
     
-    open_count = len(positions_df[positions_df.get('status', 'CLOSED') == 'OPEN'])
-    closed_count = len(positions_df[positions_df.get('status', 'CLOSED') == 'CLOSED'])
+    # Count with a single reduction instead of filtering out subset frames
+    status = positions_df.get('status', pd.Series('CLOSED', index=positions_df.index))
+    open_count = int((status == 'OPEN').sum())
+    closed_count = len(positions_df) - open_count
     
     total_pnl = positions_df['net_pnl_after_fees'].sum()
     total_commission = positions_df['commission'].sum()
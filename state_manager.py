@@ -2,10 +2,11 @@
 State management and persistence for tracking trade watermarks.
 """
 
-import json
 import os
 import logging
-from typing import Dict
+from typing import Callable, Dict, List
+
+import orjson
 
 import config
 
@@ -21,8 +22,8 @@ def load_state() -> Dict:
     """
     if os.path.exists(config.STATE_FILE):
         try:
-            with open(config.STATE_FILE, "r") as f:
-                state = json.load(f)
+            with open(config.STATE_FILE, "rb") as f:
+                state = orjson.loads(f.read())
                 logger.debug(f"Loaded state: {state}")
                 return state
         except Exception as e:
@@ -40,14 +41,46 @@ def save_state(state: Dict) -> None:
     """
     try:
         tmp = config.STATE_FILE + ".tmp"
-        with open(tmp, "w") as f:
-            json.dump(state, f, indent=2)
+        with open(tmp, "wb") as f:
+            f.write(orjson.dumps(state, option=orjson.OPT_INDENT_2))
         os.replace(tmp, config.STATE_FILE)
         logger.debug(f"State saved: {state}")
     except Exception as e:
         logger.error(f"Failed to save state: {e}")
 
 
+def seed_known_symbols(state: Dict, stored_symbols: Callable[[], List[str]]) -> bool:
+    """
+    Add known_symbols to state files written before that key existed.
+    
+    Symbols are taken from the per-symbol ID watermark, which covers every
+    symbol with stored fills; stored_symbols() is only called when the
+    watermark is empty. The seeded state is saved right away so the lookup
+    happens once.
+    
+    Args:
+        state: Current state dictionary (updated in place)
+        stored_symbols: Callable returning the symbols found in stored fills
+        
+    Returns:
+        True if state was seeded, False if it already had known_symbols
+    """
+    if "known_symbols" in state:
+        return False
+    
+    symbols = set(state.get("last_id_by_symbol", {}))
+    if not symbols:
+        try:
+            symbols = set(stored_symbols())
+        except Exception as e:
+            logger.warning(f"Could not load historical symbols: {e}")
+    
+    state["known_symbols"] = sorted(symbols)
+    save_state(state)
+    logger.info(f"Seeded {len(symbols)} known symbols")
+    return True
+
+
 def get_last_trade_time(state: Dict) -> int:
     """Get last recorded trade timestamp in milliseconds."""
     return state.get("last_trade_time_ms", 0)
@@ -72,17 +105,27 @@ def update_watermark(state: Dict, trades: list) -> Dict:
     if not trades:
         return state
     
+    # Single pass: global max time and per-symbol max id
+    max_time = 0
+    max_id_by_symbol = {}
+    for t in trades:
+        if t['time'] > max_time:
+            max_time = t['time']
+        symbol = t['symbol']
+        if t['id'] > max_id_by_symbol.get(symbol, 0):
+            max_id_by_symbol[symbol] = t['id']
+    
     # Update time watermark
-    max_time = max(t['time'] for t in trades)
     state["last_trade_time_ms"] = max(state.get("last_trade_time_ms", 0), max_time)
     
     # Update per-symbol ID watermark
     if "last_id_by_symbol" not in state:
         state["last_id_by_symbol"] = {}
+    state["last_id_by_symbol"].update(max_id_by_symbol)
     
-    for symbol in set(t['symbol'] for t in trades):
-        symbol_trades = [t for t in trades if t['symbol'] == symbol]
-        max_id = max(t['id'] for t in symbol_trades)
-        state["last_id_by_symbol"][symbol] = max_id
+    # Track every symbol with stored fills so they keep being queried
+    known_symbols = set(state.get("known_symbols", []))
+    if not known_symbols.issuperset(max_id_by_symbol):
+        state["known_symbols"] = sorted(known_symbols.union(max_id_by_symbol))
     
     return state